@@ -0,0 +1,28 @@
+"""
+Production server config for the RAG service.
+Run with:  gunicorn -c gunicorn_conf.py main:app   (from rag-service/)
+"""
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+# Async workers don't need 2*cpu. One per ingestion process (main's
+# INGEST_PROCESSES = cpu/2) gives each worker one ingestion child with the
+# same ORT threads per upload as a single server; beyond that, workers skip
+# the pool and build indexes in-process so the host never exceeds cpu/2
+# ingestion children.
+workers = int(os.getenv("GUNICORN_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+worker_class = "uvicorn_worker.UvicornWorker"
+# main splits CPU threads between this many server processes
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+# Import main (numba kernels, langchain, faiss, onnxruntime) once in the
+# master so workers share those pages copy-on-write. Importing main creates
+# no ORT session, SQLite handle or process pool; each worker builds its own
+# in the app lifespan after the fork (CUDA included, so preload is safe on
+# faiss-gpu hosts too).
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# Async workers only miss this heartbeat if the event loop blocks; requests
+# themselves are bounded by LLM_TIMEOUT_SECONDS and the ingestion pool
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
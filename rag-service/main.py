@@ -1,27 +1,45 @@
 from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel, Field, validator
+from cachetools import TTLCache
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.prompts import PromptTemplate
-from groq import Groq
+from groq import AsyncGroq
 from dotenv import load_dotenv
-from transformers import (
-    AutoConfig,
-    AutoTokenizer,
-    AutoModelForSeq2SeqLM,
-    AutoModelForCausalLM,
-)
+from tokenizers import Tokenizer
 from slowapi import Limiter
 from slowapi.util import get_remote_address
-import os 
+from pathlib import Path
+from string import Template
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import fcntl
+import gc
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
 import re
+import sqlite3
+import stat
+import tempfile
+import time
+import docx
+import faiss
+import numba
+import numpy as np
+import onnxruntime as ort
 import uvicorn
-from slowapi import Limiter
-from slowapi.util import get_remote_address
 import threading
+import uuid
 from datetime import datetime
 
 # ===============================
@@ -32,85 +50,651 @@ load_dotenv()
 BASE_DIR = Path(__file__).resolve().parent.parent
 UPLOAD_DIR = (BASE_DIR / "uploads").resolve()
 
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs in each server process — after gunicorn forks, never in its master
+    init_web_process()
+    sweeper = asyncio.create_task(sweep_sessions_periodically())
+    yield
+    sweeper.cancel()
+    if INGEST_EXECUTOR is not None:
+        INGEST_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(lifespan=lifespan)
 limiter = Limiter(key_func=get_remote_address)
 app.state.limiter = limiter
 
+# Async client so the LLM round-trip never ties up a threadpool slot
+groq_client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
+# Per-request wall-clock cap on generation; the request is cancelled, not orphaned
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
 
 
 # ---------------------------------------------------------------------------
-# GLOBAL STATE MANAGEMENT (Thread-safe, Multi-user support)
+# EMBEDDINGS (INT8-quantized ONNX Runtime)
 # ---------------------------------------------------------------------------
-# Per-user/session storage with proper cleanup and locking
-sessions = {}  # {session_id: {"vectorstore": FAISS, "upload_time": datetime}}
-sessions_lock = threading.RLock()  # Thread-safe access to sessions
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+ONNX_EMBEDDING_DIR = Path(
+    os.getenv("ONNX_EMBEDDING_DIR", Path(__file__).resolve().parent / "models" / "all-MiniLM-L6-v2-int8")
+)
+ONNX_EMBEDDING_FILE = "model_quantized.onnx"
+EMBEDDING_CACHE_PATH = Path(
+    os.getenv("EMBEDDING_CACHE_PATH", Path(__file__).resolve().parent / "cache" / "embeddings.sqlite3")
+)
+EMBEDDING_DIM = 384
+
+# Below this many chunks PQ training is unreliable; use flat fp16 instead
+PQ_MIN_CHUNKS = 2048
+PQ_SUBQUANTIZERS = 48
+PQ_BITS = 8
+
+# Each StandardGpuResources means a CUDA context plus a temp-memory
+# reservation on GPU 0, so only FAISS_GPU_PROCESSES server processes per host
+# create one (init_web_process); the rest search the same flat indexes on CPU.
+# None on faiss-cpu builds / no CUDA and always None in ingestion children.
+FAISS_GPU_PROCESSES = int(os.getenv("FAISS_GPU_PROCESSES", "1"))
+# FAISS reserves up to 1.5 GiB by default; k <= 6 searches need very little
+FAISS_GPU_TEMP_MEMORY = 64 * 1024 * 1024
+FAISS_GPU_RESOURCES = None
+# True in every server process on a CUDA host: indexes are built flat so
+# both GPU and CPU processes can load them
+FAISS_GPU_HOST = False
+_gpu_slot = None  # open lock file held for the life of a GPU process
+# GPU resources are not thread-safe: clones and searches on them take this lock
+FAISS_GPU_LOCK = threading.Lock()
+
+
+def export_quantized_embedding_model(model_name: str, out_dir: Path):
+    """
+    One-time export of a sentence-transformers model to ONNX followed by
+    dynamic INT8 quantization. Only runs when the quantized file is missing.
+    """
+    # Export-only dependencies: these pull in torch, which nothing else needs
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    model.save_pretrained(out_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(out_dir)
+
+    quantizer = ORTQuantizer.from_pretrained(model)
+    qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=out_dir, quantization_config=qconfig)
+
+
+def ensure_quantized_embedding_model(model_name: str, model_dir: Path):
+    """
+    Exports the model unless model_dir already has it. Server processes
+    starting together wait on a lock file instead of exporting in parallel
+    or loading a half-written file.
+    """
+    model_dir.parent.mkdir(parents=True, exist_ok=True)
+    with open(model_dir.parent / f".{model_dir.name}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not (model_dir / ONNX_EMBEDDING_FILE).exists():
+            export_quantized_embedding_model(model_name, model_dir)
+
+
+def mean_pool_normalize(hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    """
+    Mean-pools token embeddings over the attention mask and L2-normalizes,
+    matching sentence-transformers' MiniLM pooling. Unit vectors let the
+    indexes use inner product as cosine similarity.
+    """
+    mask = attention_mask[..., None].astype(np.float32)
+    summed = (hidden * mask).sum(axis=1)
+    counts = np.clip(mask.sum(axis=1), 1e-9, None)
+    pooled = np.ascontiguousarray(summed / counts, dtype=np.float32)
+    faiss.normalize_L2(pooled)
+    return pooled
+
+
+class OnnxMiniLMEmbeddings(Embeddings):
+    """
+    LangChain Embeddings backed by an INT8 ONNX Runtime session.
+    Replaces HuggingFaceEmbeddings (PyTorch FP32) for faster CPU ingestion.
+    The model is exported/loaded on first use, not at construction, so
+    importing this module (gunicorn master, spawned ingestion children)
+    never creates an ORT session or its thread pool.
+    """
+
+    def __init__(
+        self,
+        model_name: str = EMBEDDING_MODEL_NAME,
+        model_dir: Path = ONNX_EMBEDDING_DIR,
+        batch_size: int = 64,
+        max_length: int = 256,
+    ):
+        self.model_name = model_name
+        self.model_dir = Path(model_dir)
+        self.model_path = self.model_dir / ONNX_EMBEDDING_FILE
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.num_threads = os.cpu_count() or 1
+
+        self._tokenizer = None
+        self._session = None
+        self._load_lock = threading.Lock()
+
+    def set_num_threads(self, num_threads: int):
+        """
+        Sets the intra-op thread count of the session created on first use.
+        An existing session is never replaced: one inherited across fork()
+        cannot be safely destroyed.
+        """
+        if self._session is not None:
+            raise RuntimeError("ORT session already created; set threads before first use")
+        self.num_threads = num_threads
+
+    def _load(self):
+        with self._load_lock:
+            if self._session is not None:
+                return
+            ensure_quantized_embedding_model(self.model_name, self.model_dir)
+            # Rust tokenizer straight from tokenizer.json; transformers would import torch
+            tokenizer = Tokenizer.from_file(str(self.model_dir / "tokenizer.json"))
+            tokenizer.enable_truncation(self.max_length)
+            tokenizer.no_padding()
+            self.pad_id = tokenizer.token_to_id("[PAD]") or 0
+            self._tokenizer = tokenizer
+
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = self.num_threads
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            session = ort.InferenceSession(
+                str(self.model_path),
+                sess_options=options,
+                providers=["CPUExecutionProvider"],
+            )
+            self.input_names = {i.name for i in session.get_inputs()}
+            self._session = session  # set last: it marks the model as loaded
+
+    @property
+    def tokenizer(self):
+        if self._session is None:
+            self._load()
+        return self._tokenizer
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._load()
+        return self._session
+
+    def _tokenize(self, texts: list[str]) -> list:
+        """Tokenizes without padding so each text keeps its own length."""
+        return self.tokenizer.encode_batch(texts)
+
+    def _embed_batch(self, encodings: list) -> np.ndarray:
+        # Pad to the longest encoding in this batch only
+        shape = (len(encodings), max(len(e.ids) for e in encodings))
+        padded = {
+            "input_ids": np.full(shape, self.pad_id, dtype=np.int64),
+            "attention_mask": np.zeros(shape, dtype=np.int64),
+            "token_type_ids": np.zeros(shape, dtype=np.int64),
+        }
+        for row, e in enumerate(encodings):
+            padded["input_ids"][row, :len(e.ids)] = e.ids
+            padded["attention_mask"][row, :len(e.ids)] = e.attention_mask
+            padded["token_type_ids"][row, :len(e.ids)] = e.type_ids
+        feed = {k: v for k, v in padded.items() if k in self.input_names}
+        hidden = self.session.run(None, feed)[0]
+        return mean_pool_normalize(hidden, padded["attention_mask"])
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        features = self._tokenize(texts)
+
+        # Longest first so every batch pads to near its own max length
+        # instead of wasting FLOPs on PAD tokens, then scatter back in order.
+        lengths = np.array([len(f.ids) for f in features])
+        order = np.argsort(lengths, kind="stable")[::-1]
+        out = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+        for i in range(0, len(order), self.batch_size):
+            batch_idx = order[i:i + self.batch_size]
+            out[batch_idx] = self._embed_batch([features[j] for j in batch_idx])
+        return out.tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed_batch(self._tokenize([text]))[0].tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Persistent content-hash cache in front of another Embeddings.
+    Re-uploads and overlapping chunks skip the model entirely; vectors are
+    stored as float16 in SQLite to halve disk usage.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache_path: Path, namespace: str):
+        self.embeddings = embeddings
+        self.namespace = namespace.encode("utf-8")
+        self.cache_path = Path(cache_path)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        This process's SQLite connection, opened on first use. SQLite handles
+        must not be shared across fork(), so a child never touches (or closes)
+        an inherited one; it opens its own. Caller holds self._lock.
+        """
+        if self._conn_pid != os.getpid():
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.cache_path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            conn.commit()
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    def _key(self, text: str) -> bytes:
+        # Namespaced by model so swapping models never serves stale vectors
+        return hashlib.sha256(self.namespace + b"\0" + text.encode("utf-8")).digest()[:16]
+
+    def _lookup(self, keys: list[bytes]) -> dict:
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float16)
+        return found
+
+    def _store(self, items: dict):
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vec.tobytes()) for key, vec in items.items()],
+            )
+            conn.commit()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        keys = [self._key(t) for t in texts]
+        found = self._lookup(list(set(keys)))
+
+        # Embed each distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = {
+                key: np.asarray(vec, dtype=np.float16)
+                for key, vec in zip(missing.keys(), vectors)
+            }
+            self._store(computed)
+            found.update(computed)
 
-# Load local embedding model (unchanged — FAISS retrieval stays the same)
-embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+        # Always serve the float16 copy so hits and misses are identical
+        return [found[key].astype(np.float32).tolist() for key in keys]
 
-embedding_model = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-MiniLM-L6-v2"
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """Batch query embedding; bypasses the cache like embed_query."""
+        return self.embeddings.embed_documents(texts)
+
+
+# ---------------------------------------------------------------------------
+# GLOBAL STATE MANAGEMENT (Thread-safe, Multi-user support)
+# ---------------------------------------------------------------------------
+# Sessions live in SESSION_DIR so every worker process sees every upload:
+#   <key>.json                {"upload_time", "token"} — small, read by /status
+#   <key>.<token>.faiss       FAISS index, mmap'd read-only by each worker
+#   <key>.<token>.chunks.json {"texts", "metadatas"}
+# `sessions` is only this process's cache of loaded stores, validated by the
+# .json file's mtime on every lookup. Metadata is JSON, never pickle: these
+# files sit in a shared temp filesystem.
+SESSION_DIR = Path(os.getenv(
+    "SESSION_DIR",
+    Path("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()) / "pdf-qa-sessions",
+))
+# Sessions are deleted this long after their last upload
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", 24 * 3600))
+SESSION_SWEEP_INTERVAL_SECONDS = 600
+# MMAP_IFC maps flat-code indexes (fp16 SQ, PQ, Flat) instead of copying them
+SESSION_INDEX_IO_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+# Bounded so a worker never pins every session it has ever served: entries
+# expire after SESSION_CACHE_TTL_SECONDS (then reload from SESSION_DIR) and
+# the least recently used go first when full
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "64"))
+SESSION_CACHE_TTL_SECONDS = 600
+# {session_id: {"vectorstore": FAISS, "upload_time": str, "mtime": int}}
+sessions = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL_SECONDS)
+sessions_lock = threading.Lock()  # Guards dict get/set only — never held across search or LLM calls
+
+# Load local embedding model (INT8 ONNX port of MiniLM — same 384-d vectors)
+# Wrapped in a content-hash cache so re-uploaded chunks are never re-embedded
+embedding_model = CachedEmbeddings(
+    OnnxMiniLMEmbeddings(), EMBEDDING_CACHE_PATH, namespace=EMBEDDING_MODEL_NAME
 )
 
+# /summarize always retrieves with the same query; embedded once per process
+# by init_web_process
+SUMMARY_QUERY = "Give a concise summary of the document."
+SUMMARY_QUERY_VECTOR = None
+
 # ---------------------------------------------------------------------------
 # SESSION MANAGEMENT UTILITIES (Thread-safe, Multi-user support)
 # ---------------------------------------------------------------------------
 
+def _session_key(session_id: str) -> str:
+    # Session IDs come from a request header; never use them as file names
+    return hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32]
+
+
+def _session_meta_path(session_id: str) -> Path:
+    return SESSION_DIR / f"{_session_key(session_id)}.json"
+
+
+def prepare_session_dir():
+    """
+    Creates SESSION_DIR private to this user. Its default parent is world-
+    writable and its name predictable, so refuse a directory (or symlink)
+    that another user owns or can write into.
+    """
+    SESSION_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+    st = SESSION_DIR.lstat()
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise RuntimeError(f"{SESSION_DIR} is not a directory owned by this user")
+    if st.st_mode & 0o022:
+        raise RuntimeError(f"{SESSION_DIR} is writable by other users; chmod it to 0700")
+
+
+@contextmanager
+def _session_dir_lock():
+    """
+    Exclusive flock on SESSION_DIR, shared by every process and thread that
+    writes or deletes session files. Readers don't take it; they only follow
+    the .json commit point.
+    """
+    with open(SESSION_DIR / ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield  # closing the file releases the lock
+
+
+def _read_session_meta(meta_path: Path) -> dict:
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    # The token becomes part of file names; never follow anything else
+    if not re.fullmatch(r"[0-9a-f]{32}", str(meta.get("token"))):
+        raise ValueError(f"Corrupt session metadata: {meta_path.name}")
+    return meta
+
+
+def _load_session(meta_path: Path):
+    meta = _read_session_meta(meta_path)
+    prefix = f"{meta_path.stem}.{meta['token']}"
+    index = faiss.read_index(str(SESSION_DIR / f"{prefix}.faiss"), SESSION_INDEX_IO_FLAGS)
+    with open(SESSION_DIR / f"{prefix}.chunks.json", encoding="utf-8") as f:
+        chunks = json.load(f)
+    vectorstore = make_vectorstore(move_index_to_gpu(index), chunks["texts"], chunks["metadatas"])
+    return vectorstore, meta["upload_time"]
+
+
+def _drop_cached_session(session_id: str):
+    with sessions_lock:
+        old_session = sessions.pop(session_id, None)
+    if old_session is not None:
+        _after_eviction()
+
+
+def prune_session_cache():
+    """
+    Drops cached stores whose session was swept, cleared or replaced by
+    another worker. Until dropped they keep the old index file mapped, and
+    an unlinked file in /dev/shm still holds its RAM.
+    """
+    with sessions_lock:
+        sessions.expire()
+        cached = list(sessions.items())
+    for session_id, entry in cached:
+        try:
+            mtime = _session_meta_path(session_id).stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == entry["mtime"]:
+            continue
+        with sessions_lock:
+            if sessions.get(session_id) is entry:
+                sessions.pop(session_id, None)
+        _after_eviction()
+
+
 def get_session_vectorstore(session_id: str):
     """
     Safely retrieves vectorstore for a session.
     Returns (vectorstore, upload_time) or (None, None) if not found.
+    The returned reference stays valid even if the session is replaced or
+    cleared mid-request, so callers search it without holding the lock.
+    Reloads from SESSION_DIR when another worker has replaced the session.
+    Does file I/O — call via asyncio.to_thread from handlers.
     """
-    with sessions_lock:
-        if session_id in sessions:
-            session_data = sessions[session_id]
-            return session_data.get("vectorstore"), session_data.get("upload_time")
-        return None, None
+    meta_path = _session_meta_path(session_id)
+    for _ in range(2):
+        try:
+            mtime = meta_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            _drop_cached_session(session_id)
+            return None, None
 
+        with sessions_lock:
+            cached = sessions.get(session_id)
+        if cached is not None and cached["mtime"] == mtime:
+            return cached["vectorstore"], cached["upload_time"]
 
-def set_session_vectorstore(session_id: str, vectorstore, upload_time: str):
+        try:
+            vectorstore, upload_time = _load_session(meta_path)
+        except FileNotFoundError:
+            continue  # replaced or cleared between stat and read; look again
+
+        with sessions_lock:
+            old_session = sessions.get(session_id)
+            sessions[session_id] = {
+                "vectorstore": vectorstore,
+                "upload_time": upload_time,
+                "mtime": mtime,
+            }
+        if old_session is not None:
+            _after_eviction()
+        return vectorstore, upload_time
+    return None, None
+
+
+def get_session_upload_time(session_id: str):
     """
-    Safely stores vectorstore for a session.
-    Clears old session if it exists (replaces it).
+    upload_time of the session's current PDF, or None if there is none.
+    Reads only the small .json: no index is mapped and no cache is touched.
     """
-    with sessions_lock:
-        # Clear old session to prevent memory leaks
-        if session_id in sessions:
-            old_vectorstore = sessions[session_id].get("vectorstore")
-            if old_vectorstore is not None:
-                del old_vectorstore  # Allow garbage collection
-        
-        # Store new session
-        sessions[session_id] = {
-            "vectorstore": vectorstore,
-            "upload_time": upload_time
-        }
+    try:
+        return _read_session_meta(_session_meta_path(session_id))["upload_time"]
+    except FileNotFoundError:
+        return None
+
+
+def set_session_index(session_id: str, index_bytes: np.ndarray, texts: list[str],
+                      metadatas: list[dict], upload_time: str):
+    """
+    Safely stores a serialized index for a session.
+    Replaces the old session if it exists; other workers pick up the new
+    one on their next lookup. The .json rename is the commit point.
+    Writers are serialized so a concurrent upload to the same session can
+    never delete the index file the winning .json points to.
+    """
+    key = _session_key(session_id)
+    token = uuid.uuid4().hex
+    prefix = f"{key}.{token}"
+
+    with _session_dir_lock():
+        np.asarray(index_bytes).tofile(SESSION_DIR / f"{prefix}.faiss")
+        with open(SESSION_DIR / f"{prefix}.chunks.json", "w", encoding="utf-8") as f:
+            # default=str: PDF metadata values are not guaranteed JSON types
+            json.dump({"texts": texts, "metadatas": metadatas}, f, default=str)
+        tmp_path = SESSION_DIR / f"{prefix}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"upload_time": upload_time, "token": token}, f)
+        os.replace(tmp_path, _session_meta_path(session_id))
+
+        # Workers that already mmap'd an old index keep it until they unmap
+        for stale in SESSION_DIR.glob(f"{key}.*.*"):
+            if not stale.name.startswith(f"{prefix}."):
+                stale.unlink(missing_ok=True)
+    _drop_cached_session(session_id)
 
 
 def clear_session(session_id: str):
     """
     Safely clears a specific session's vectorstore and data.
     """
-    with sessions_lock:
-        if session_id in sessions:
-            old_vectorstore = sessions[session_id].get("vectorstore")
-            if old_vectorstore is not None:
-                del old_vectorstore  # Allow garbage collection
-            del sessions[session_id]
+    key = _session_key(session_id)
+    with _session_dir_lock():
+        _session_meta_path(session_id).unlink(missing_ok=True)
+        for data_path in SESSION_DIR.glob(f"{key}.*.*"):
+            data_path.unlink(missing_ok=True)
+    _drop_cached_session(session_id)
 
 
+GC_EVERY_N_EVICTIONS = 32
+_eviction_counter = itertools.count(1)
 
-def normalize_spaced_text(text: str) -> str:
-    pattern = r"\b(?:[A-Za-z] ){2,}[A-Za-z]\b"
+
+def _after_eviction():
+    """
+    Dropping a cached session frees (unmaps) its FAISS index by refcount as
+    soon as no in-flight request still holds it. index.reset() is deliberately not
+    called: a concurrent search on that index would read freed memory.
+    A full gc pass every GC_EVERY_N_EVICTIONS evictions reclaims any cycles
+    through LangChain objects without paying for gc on every upload.
+    """
+    if next(_eviction_counter) % GC_EVERY_N_EVICTIONS == 0:
+        gc.collect()
+
+
+# ---------------------------------------------------------------------------
+# ANSWER CACHE (repeat questions skip retrieval + LLM)
+# ---------------------------------------------------------------------------
+answer_cache = TTLCache(maxsize=4096, ttl=600)
+answer_cache_lock = threading.Lock()
+
+
+def answer_cache_key(kind: str, *scope, text: str = "") -> tuple:
+    """
+    Builds a cache key from the endpoint, its (session_id, upload_time)
+    pairs and a digest of the prompt inputs. upload_time changes on every
+    re-upload, so stale answers are never served for a new PDF.
+    """
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    return (kind, *scope, digest)
+
+
+def get_cached_answer(key: tuple):
+    with answer_cache_lock:
+        return answer_cache.get(key)
+
+
+def set_cached_answer(key: tuple, answer: str):
+    with answer_cache_lock:
+        answer_cache[key] = answer
+
+
+# Compiled once at import; both helpers run on every page and every answer
+_SPACED_RE = re.compile(r"\b(?:[A-Za-z] ){2,}[A-Za-z]\b")
+_LEAK_RE = re.compile(r"^(Answer[^:]*:|Context:|Question:)\s*", re.IGNORECASE)
+
+
+def _join_spaced_letters(match: re.Match) -> str:
+    return match.group(0).replace(" ", "")
 
 
+@numba.njit(cache=True)
+def _is_ascii_alpha(c):
+    return (65 <= c <= 90) or (97 <= c <= 122)
+
+
+@numba.njit(cache=True)
+def _is_ascii_word(c):
+    return _is_ascii_alpha(c) or (48 <= c <= 57) or c == 95
+
+
+@numba.njit(cache=True)
+def _collapse_spaced_letters(buf, out):
+    """
+    Single pass over ASCII bytes equivalent to _SPACED_RE.sub: runs of 3+
+    single letters separated by single spaces, bounded by non-word chars,
+    are copied without their spaces. Returns the output length.
+    """
+    n = buf.shape[0]
+    i = 0
+    j = 0
+    while i < n:
+        c = buf[i]
+        if _is_ascii_alpha(c) and (i == 0 or not _is_ascii_word(buf[i - 1])):
+            end = i
+            count = 1
+            while end + 2 < n and buf[end + 1] == 32 and _is_ascii_alpha(buf[end + 2]):
+                end += 2
+                count += 1
+            # Last letter needs a word boundary after it; otherwise back off one
+            if end + 1 < n and _is_ascii_word(buf[end + 1]):
+                end -= 2
+                count -= 1
+            if count >= 3:
+                k = i
+                while k <= end:
+                    out[j] = buf[k]
+                    j += 1
+                    k += 2
+                i = end + 1
+                continue
+        out[j] = c
+        j += 1
+        i += 1
+    return j
+
+
+def normalize_spaced_text(text: str) -> str:
+    """
+    Collapses character-spaced words ("C e r t i f i c a t e") back into
+    normal words. PDF extractors often emit these for letter-spaced fonts.
+    ASCII text takes the compiled byte scan; anything else uses the regex,
+    whose \\b is Unicode-aware.
+    """
+    if not text.isascii():
+        return _SPACED_RE.sub(_join_spaced_letters, text)
+    buf = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    out = np.empty(len(buf), dtype=np.uint8)
+    n = _collapse_spaced_letters(buf, out)
+    return out[:n].tobytes().decode("ascii")
+
 
 def normalize_answer(text: str) -> str:
     """
     Post-processes the LLM-generated answer.
     """
     text = normalize_spaced_text(text)
-    text = re.sub(r"^(Answer[^:]*:|Context:|Question:)\s*", "", text, flags=re.I)
+    text = _LEAK_RE.sub("", text)
     return text.strip()
 
 
@@ -144,16 +728,429 @@ def load_document(file_path: str):
         raise ValueError("Unsupported file format")
 
 
+class EmptyPDFError(ValueError):
+    """The PDF has no pages at all (as opposed to pages without text)."""
+
+
+def stream_pdf_chunks(file_path: str):
+    """
+    Yields (text, metadata) chunks one page at a time: load page -> normalize
+    -> split, with no intermediate Document lists for the whole PDF.
+    Raises EmptyPDFError if the loader yields no pages.
+    """
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
+    pages = 0
+    for page in PyPDFLoader(file_path).lazy_load():
+        pages += 1
+        # ── Layer 1: normalize at ingestion ──────────────────────────────────
+        text = normalize_spaced_text(page.page_content)
+        for chunk in splitter.split_text(text):
+            # Own copy per chunk so one chunk's metadata edits never leak
+            yield chunk, dict(page.metadata)
+    if not pages:
+        raise EmptyPDFError("PDF file is empty or unreadable. Please check your file.")
+
+
+def load_and_split_pdf(file_path: str):
+    """
+    Collects streamed chunks into the flat texts/metadatas buffers that
+    build_index needs.
+    CPU-bound — runs inside the ingestion process pool.
+    """
+    texts, metadatas = [], []
+    for text, metadata in stream_pdf_chunks(file_path):
+        texts.append(text)
+        metadatas.append(metadata)
+    return texts, metadatas
+
+
+def create_faiss_index(vectors: np.ndarray, for_gpu: bool = False):
+    """
+    Picks a compressed FAISS index for the document size.
+    Small docs: flat scan over fp16 codes (half the RAM of a float32 flat).
+    Large docs: PQ with 48 x 8-bit sub-quantizers (32x smaller than fp32).
+    Embeddings are unit-length, so every index scores by inner product
+    (= cosine) rather than L2.
+
+    Indexes stay per-session on purpose: a shared IndexIDMap2(IndexHNSWFlat)
+    cannot remove_ids, so clearing a session would never free its vectors.
+    A per-session index is released whole when the session is replaced.
+    """
+    dim = vectors.shape[1]
+    if for_gpu:
+        # GPU processes clone it to a float16 GpuIndexFlat; the rest search it on CPU
+        return faiss.IndexFlatIP(dim)
+
+    if len(vectors) < PQ_MIN_CHUNKS:
+        return faiss.IndexScalarQuantizer(
+            dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT
+        )
+
+    index = faiss.IndexPQ(dim, PQ_SUBQUANTIZERS, PQ_BITS, faiss.METRIC_INNER_PRODUCT)
+    # PQ_MIN_CHUNKS guarantees 8 points per centroid; don't demand FAISS' default 39
+    index.pq.cp.min_points_per_centroid = PQ_MIN_CHUNKS // (1 << PQ_BITS)
+    index.train(vectors)
+    return index
+
+
+def move_index_to_gpu(index):
+    """
+    GPU FAISS has no flat SQ/PQ; a float16 GpuIndexFlat gives the same
+    memory saving as the CPU fp16 path and searches far faster.
+    """
+    if FAISS_GPU_RESOURCES is None:
+        return index
+    options = faiss.GpuClonerOptions()
+    options.useFloat16 = True
+    with FAISS_GPU_LOCK:
+        return faiss.index_cpu_to_gpu(FAISS_GPU_RESOURCES, 0, index, options)
+
+
+def search_index(index, queries: np.ndarray, k: int):
+    """index.search, serialized when the index lives on the shared GPU resources."""
+    if FAISS_GPU_RESOURCES is None:
+        return index.search(queries, k)
+    with FAISS_GPU_LOCK:
+        return index.search(queries, k)
+
+
+def build_index(file_path: str, for_gpu: bool = False):
+    """
+    Full CPU ingestion pipeline, run inside an INGEST_EXECUTOR process:
+    stream chunks -> embed through the cache -> build the FAISS index.
+    for_gpu (any CUDA host) builds a flat index: GPU server processes clone
+    it to the device, the others search it on CPU.
+    Returns (serialized_index, texts, metadatas), or None if no text.
+    """
+    texts, metadatas = load_and_split_pdf(file_path)
+    if not texts:
+        return None
+
+    vectors = np.asarray(embedding_model.embed_documents(texts), dtype=np.float32)
+    index = create_faiss_index(vectors, for_gpu)
+    index.add(vectors)
+    return faiss.serialize_index(index), texts, metadatas
+
+
+def make_vectorstore(index, texts: list[str], metadatas: list[dict]):
+    """
+    Wraps an already-populated index in the LangChain FAISS store; vectors
+    are not re-added, only the docstore mapping is created.
+    """
+    ids = [str(uuid.uuid4()) for _ in texts]
+    docstore = InMemoryDocstore({
+        doc_id: Document(id=doc_id, page_content=text, metadata=metadata)
+        for doc_id, text, metadata in zip(ids, texts, metadatas)
+    })
+    return FAISS(
+        embedding_model,
+        index,
+        docstore,
+        dict(enumerate(ids)),
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+    )
+
+
+# ---------------------------------------------------------------------------
+# INGESTION WORKERS (process pool — PDF parsing + embedding hold the GIL)
+# ---------------------------------------------------------------------------
+# Ingestion processes per host, shared out between the server processes
+INGEST_PROCESSES = max(1, (os.cpu_count() or 2) // 2)
+# Server processes on this host; gunicorn_conf exports its worker count
+WEB_WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+# Created per server process by init_web_process. Stays None when there are
+# more server processes than INGEST_PROCESSES: a pool each would overshoot
+# the budget, so those processes build indexes in a thread instead.
+INGEST_EXECUTOR = None
+
+
+def _init_ingest_worker(num_threads: int):
+    """
+    Pool processes are spawned and import this module without loading the
+    model; cap ORT threads before the first embed creates the session.
+    """
+    embedding_model.embeddings.set_num_threads(num_threads)
 
-    if is_enc:
-        return tokenizer.decode(output[0], skip_special_tokens=True)
 
-    return tokenizer.decode(
-        output[0][encoded["input_ids"].shape[1]:],
-        skip_special_tokens=True,
+def create_ingest_executor():
+    """
+    This server process's share of INGEST_PROCESSES (at least one, as
+    init_web_process only calls this when WEB_WORKERS <= INGEST_PROCESSES).
+    Each server process owns a pool, so ORT threads are budgeted over every
+    child on the host.
+    """
+    pool_size = INGEST_PROCESSES // WEB_WORKERS
+    threads_per_child = max(1, (os.cpu_count() or 1) // (pool_size * WEB_WORKERS))
+    # spawn, not fork: ORT/FAISS thread pools in the parent are not fork-safe
+    return ProcessPoolExecutor(
+        max_workers=pool_size,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_ingest_worker,
+        initargs=(threads_per_child,),
     )
 
 
+def _claim_gpu_slot() -> bool:
+    """
+    Takes one of FAISS_GPU_PROCESSES host-wide slots. The flock is released
+    when the process exits, so a restarted worker can take over its slot.
+    """
+    global _gpu_slot
+    for n in range(FAISS_GPU_PROCESSES):
+        slot = open(SESSION_DIR / f".gpu-slot-{n}", "a")
+        try:
+            fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            slot.close()
+            continue
+        _gpu_slot = slot
+        return True
+    return False
+
+
+def init_web_process():
+    """
+    Per-process startup for a server process, run from the app lifespan.
+    Ingestion children import this module too but only need build_index,
+    so nothing here runs at import: GPU resources, the session dir, the
+    ingestion pool, and the SUMMARY_QUERY embedding (which creates this
+    process's ORT session).
+    """
+    global FAISS_GPU_HOST, FAISS_GPU_RESOURCES, INGEST_EXECUTOR, SUMMARY_QUERY_VECTOR
+    prepare_session_dir()
+    FAISS_GPU_HOST = faiss.get_num_gpus() > 0
+    if FAISS_GPU_HOST and _claim_gpu_slot():
+        FAISS_GPU_RESOURCES = faiss.StandardGpuResources()
+        FAISS_GPU_RESOURCES.setTempMemory(FAISS_GPU_TEMP_MEMORY)
+    if WEB_WORKERS <= INGEST_PROCESSES:
+        INGEST_EXECUTOR = create_ingest_executor()
+
+    embedding_model.embeddings.set_num_threads(max(1, (os.cpu_count() or 1) // WEB_WORKERS))
+    SUMMARY_QUERY_VECTOR = embedding_model.embed_query(SUMMARY_QUERY)
+
+
+def _replace_broken_executor(broken: ProcessPoolExecutor):
+    """
+    A dead child (OOM kill, native crash in a parser) breaks the whole pool
+    for good; swap in a fresh one once, however many jobs saw it break.
+    """
+    global INGEST_EXECUTOR
+    if INGEST_EXECUTOR is broken:
+        INGEST_EXECUTOR = create_ingest_executor()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+
+# {pdf sha256: pending pool future} — concurrent uploads of one file share a job
+_ingest_inflight = {}
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def _run_build_index(file_path: str):
+    for_gpu = FAISS_GPU_HOST
+    executor = INGEST_EXECUTOR
+    if executor is None:
+        return await asyncio.to_thread(build_index, file_path, for_gpu)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, build_index, file_path, for_gpu
+        )
+    except BrokenProcessPool:
+        # Not retried: the same file may crash the fresh pool too
+        _replace_broken_executor(executor)
+        raise RuntimeError("ingestion worker crashed, please retry the upload") from None
+
+
+async def ingest_pdf(file_path: str):
+    """
+    Runs build_index in the process pool, deduplicated by file content.
+    Returns build_index's (index_bytes, texts, metadatas), or None if the
+    PDF has no text.
+    """
+    key = await asyncio.to_thread(file_sha256, file_path)
+    future = _ingest_inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(_run_build_index(file_path))
+        _ingest_inflight[key] = future
+        future.add_done_callback(lambda _: _ingest_inflight.pop(key, None))
+
+    # shield: one cancelled request must not cancel the job for the others
+    return await asyncio.shield(future)
+
+
+# ---------------------------------------------------------------------------
+# BATCHED RETRIEVAL
+# ---------------------------------------------------------------------------
+class BatchedSearcher:
+    """
+    Coalesces similarity searches that arrive within a short window: one
+    ONNX pass embeds every pending query, and each index is searched once
+    with all of its queries stacked into a (nq, d) matrix.
+    """
+
+    def __init__(self, window: float = 0.005):
+        self.window = window
+        self._queue = None
+        self._worker = None
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def search(self, vectorstore, query, k: int) -> list[Document]:
+        """
+        Top-k documents from vectorstore. query is either text to embed or
+        a precomputed query vector.
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((vectorstore, query, k, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await asyncio.to_thread(self._search_batch, batch)
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for (_, _, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    @staticmethod
+    def _search_batch(batch: list) -> list:
+        # Embed each distinct query text once, all in a single forward pass
+        texts = list(dict.fromkeys(q for _, q, _, _ in batch if isinstance(q, str)))
+        vectors = dict(zip(texts, embedding_model.embed_queries(texts))) if texts else {}
+
+        groups = {}  # {id(vectorstore): (vectorstore, [batch positions])}
+        for pos, (vectorstore, _, _, _) in enumerate(batch):
+            groups.setdefault(id(vectorstore), (vectorstore, []))[1].append(pos)
+
+        results = [None] * len(batch)
+        for vectorstore, positions in groups.values():
+            try:
+                queries = np.array(
+                    [vectors[batch[p][1]] if isinstance(batch[p][1], str) else batch[p][1]
+                     for p in positions],
+                    dtype=np.float32,
+                )
+                max_k = max(batch[p][2] for p in positions)
+                _, indices = search_index(vectorstore.index, queries, max_k)
+                for row, p in enumerate(positions):
+                    results[p] = [
+                        vectorstore.docstore.search(vectorstore.index_to_docstore_id[i])
+                        for i in indices[row][:batch[p][2]]
+                        if i != -1
+                    ]
+            except Exception as e:
+                # Only this session's searches fail; other groups still resolve
+                for p in positions:
+                    results[p] = e
+        return results
+
+
+search_batcher = BatchedSearcher()
+
+
+# ===============================
+# PROMPT TEMPLATES
+# ===============================
+# Built once at import; handlers only fill in the per-request fields
+ASK_PROMPT = Template("""You are a helpful assistant answering questions ONLY from the provided PDF document.
+
+Conversation History (for context only):
+$history
+
+Document Context (ONLY reference this):
+$context
+
+Current Question:
+$question
+
+Instructions:
+- Answer ONLY using the document context provided above.
+- Do NOT use any information from previous documents or conversations outside this context.
+- If the answer is not in the document, say so briefly.
+- Keep the answer concise (2-3 sentences max).
+
+Answer:""")
+
+SUMMARIZE_PROMPT = Template(
+    "You are a document summarization assistant working with a certificate or official document.\n"
+    "RULES:\n"
+    "1. Summarize in 6-8 concise bullet points.\n"
+    "2. Clearly distinguish: who received the certificate, what course, which company issued it,\n"
+    "   who signed it, on what platform, and on what date.\n"
+    "3. Return clean, properly formatted text — no character spacing, proper Title Case for names.\n"
+    "4. Use ONLY the information in the context below.\n"
+    "5. DO NOT reference any other documents or previous PDFs.\n\n"
+    "Context:\n$context\n\n"
+    "Summary (bullet points):"
+)
+
+COMPARE_PROMPT = Template("""You are a document comparison assistant.
+
+PDF 1 Context:
+$context_1
+
+PDF 2 Context:
+$context_2
+
+Question: $question
+
+Compare the two documents regarding this question and highlight key differences and similarities.
+
+Comparison:""")
+
+
+# ===============================
+# LLM GENERATION
+# ===============================
+async def generate_response(prompt: str, max_new_tokens: int = 512) -> str:
+    """
+    Sends the prompt to Groq and returns the raw completion text.
+    Awaits the HTTP call instead of blocking a worker thread.
+    The SDK's own timeout is per attempt and it retries, so the whole call,
+    retries included, is capped at LLM_TIMEOUT_SECONDS here.
+    """
+    try:
+        completion = await asyncio.wait_for(
+            groq_client.chat.completions.create(
+                model=GROQ_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_new_tokens,
+            ),
+            LLM_TIMEOUT_SECONDS,
+        )
+    except asyncio.TimeoutError:
+        raise asyncio.TimeoutError(
+            f"LLM did not respond within {LLM_TIMEOUT_SECONDS:g} seconds"
+        ) from None
+    return completion.choices[0].message.content or ""
+
+
 # ===============================
 # REQUEST MODELS
 # ===============================
@@ -188,12 +1185,42 @@ class CompareRequest(BaseModel):
 # -------------------------------------------------------------------
 
 
-def cleanup_expired_sessions():
-    now = time.time()
-    expired = [k for k, v in sessions.items()
-               if now - v["last"] > SESSION_TIMEOUT]
-    for k in expired:
-        del sessions[k]
+def sweep_expired_sessions():
+    """
+    Deletes sessions last uploaded more than SESSION_TTL_SECONDS ago, and
+    any data file no session points to (e.g. left by a crashed writer).
+    Workers still holding an expired store drop it on their next lookup.
+    """
+    cutoff = time.time() - SESSION_TTL_SECONDS
+    with _session_dir_lock():
+        live = {}  # {key: token} of unexpired sessions
+        for meta_path in SESSION_DIR.glob("*.json"):
+            if "." in meta_path.stem:
+                continue  # <key>.<token>.chunks.json
+            try:
+                if meta_path.stat().st_mtime >= cutoff:
+                    live[meta_path.stem] = _read_session_meta(meta_path)["token"]
+                    continue
+            except (OSError, ValueError):
+                pass  # unreadable metadata is swept like an expired one
+            meta_path.unlink(missing_ok=True)
+
+        for data_path in SESSION_DIR.glob("*.*.*"):
+            if data_path.name.startswith("."):
+                continue  # lock files
+            key, token = data_path.name.split(".")[:2]
+            if live.get(key) != token:
+                data_path.unlink(missing_ok=True)
+
+
+async def sweep_sessions_periodically():
+    while True:
+        try:
+            await asyncio.to_thread(sweep_expired_sessions)
+        except OSError:
+            pass  # retried next interval
+        await asyncio.to_thread(prune_session_cache)
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL_SECONDS)
 
 
 # ===============================
@@ -201,143 +1228,118 @@ def cleanup_expired_sessions():
 # ===============================
 @app.post("/process")
 @limiter.limit("15/15 minutes")
-def process_pdf(request: Request, data: PDFPath):
+async def process_pdf(request: Request, data: DocumentPath):
     """
     Process and store PDF with proper cleanup and thread-safe multi-user support.
     """
     try:
-        loader = PyPDFLoader(data.filePath)
-        raw_docs = loader.load()
+        # Parsing + embedding + FAISS build run in the ingestion process pool
+        try:
+            result = await ingest_pdf(data.filePath)
+        except EmptyPDFError as e:
+            return {"error": str(e)}
 
-        if not raw_docs:
-            return {"error": "PDF file is empty or unreadable. Please check your file."}
-
-        # ── Layer 1: normalize at ingestion ──────────────────────────────────────
-        cleaned_docs = []
-        for doc in raw_docs:
-            cleaned_content = normalize_spaced_text(doc.page_content)
-            cleaned_docs.append(Document(page_content=cleaned_content, metadata=doc.metadata))
-
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-        chunks = splitter.split_documents(cleaned_docs)
-        
-        if not chunks:
+        if result is None:
             return {"error": "No text chunks generated from the PDF. Please check your file."}
 
         # **KEY FIX**: Store per-session with automatic cleanup of old data
         session_id = request.headers.get("X-Session-ID", "default")
         upload_time = datetime.now().isoformat()
         
-        # Thread-safe storage (automatically clears old session data)
-        vectorstore = FAISS.from_documents(chunks, embedding_model)
-        set_session_vectorstore(session_id, vectorstore, upload_time)
+        # Written to the shared session dir so any worker can serve /ask
+        index_bytes, texts, metadatas = result
+        await asyncio.to_thread(set_session_index, session_id, index_bytes, texts, metadatas, upload_time)
         
         return {
             "message": "PDF processed successfully",
             "session_id": session_id,
             "upload_time": upload_time,
-            "chunks_created": len(chunks)
+            "chunks_created": len(texts)
         }
 
+    except Exception as e:
+        return {"error": f"Error processing PDF: {str(e)}"}
+
 
 @app.post("/ask")
 @limiter.limit("60/15 minutes")
-def ask_question(request: Request, data: AskRequest):
+async def ask_question(request: Request, data: AskRequest):
     """
     Answer questions using session-specific PDF context with thread-safe access.
     """
     session_id = request.headers.get("X-Session-ID", "default")
-    vectorstore, upload_time = get_session_vectorstore(session_id)
+    # Only the session lookup takes the lock; search + LLM run unlocked
+    vectorstore, upload_time = await asyncio.to_thread(get_session_vectorstore, session_id)
     
     if vectorstore is None:
         return {"answer": "Please upload a PDF first!"}
     
     try:
-        # Thread-safe vectorstore access
-        with sessions_lock:
-            question = data.question
-            history = data.history
-            conversation_context = ""
-            
-            if history:
-                for msg in history[-5:]:
-                    role = msg.get("role", "")
-                    content = msg.get("content", "")
-                    if role and content:
-                        conversation_context += f"{role}: {content}\n"
-            
-            # Search only within current session's vectorstore
-            docs = vectorstore.similarity_search(question, k=4)
-            if not docs:
-                return {"answer": "No relevant context found in the current PDF."}
-
-            context = "\n\n".join([doc.page_content for doc in docs])
-
-            prompt = f"""You are a helpful assistant answering questions ONLY from the provided PDF document.
-
-Conversation History (for context only):
-{conversation_context}
-
-Document Context (ONLY reference this):
-{context}
-
-Current Question:
-{question}
-
-Instructions:
-- Answer ONLY using the document context provided above.
-- Do NOT use any information from previous documents or conversations outside this context.
-- If the answer is not in the document, say so briefly.
-- Keep the answer concise (2-3 sentences max).
-
-Answer:"""
-
-            raw_answer = generate_response(prompt, max_new_tokens=512)
-            answer = normalize_answer(raw_answer)
-            return {"answer": answer}
+        question = data.question
+        history = data.history
+        conversation_context = "".join(
+            f"{msg['role']}: {msg['content']}\n"
+            for msg in history[-5:]
+            if msg.get("role") and msg.get("content")
+        )
+        
+        # History is part of the prompt, so it is part of the key too
+        cache_key = answer_cache_key(
+            "ask", session_id, upload_time, text=f"{conversation_context}\0{question}"
+        )
+        cached = get_cached_answer(cache_key)
+        if cached is not None:
+            return {"answer": cached}
+
+        # Search only within current session's vectorstore
+        docs = await search_batcher.search(vectorstore, question, 4)
+        if not docs:
+            return {"answer": "No relevant context found in the current PDF."}
+
+        context = "\n\n".join([doc.page_content for doc in docs])
+
+        prompt = ASK_PROMPT.substitute(
+            history=conversation_context, context=context, question=question
+        )
+
+        raw_answer = await generate_response(prompt, max_new_tokens=512)
+        answer = normalize_answer(raw_answer)
+        set_cached_answer(cache_key, answer)
+        return {"answer": answer}
             
     except Exception as e:
         return {"answer": f"Error processing question: {str(e)}"}
 
-    return {"answer": normalize_answer(answer), "confidence_score": 85}
-
 @app.post("/summarize")
 @limiter.limit("15/15 minutes")
-def summarize_pdf(request: Request, data: SummarizeRequest):
+async def summarize_pdf(request: Request, data: SummarizeRequest):
     """
     Summarize PDF using session-specific context with thread-safe access.
     """
     session_id = request.headers.get("X-Session-ID", "default")
-    vectorstore, upload_time = get_session_vectorstore(session_id)
+    vectorstore, upload_time = await asyncio.to_thread(get_session_vectorstore, session_id)
     
     if vectorstore is None:
         return {"summary": "Please upload a PDF first!"}
 
     try:
-        # Thread-safe vectorstore access
-        with sessions_lock:
-            docs = vectorstore.similarity_search("Give a concise summary of the document.", k=6)
-            if not docs:
-                return {"summary": "No document context available to summarize."}
-
-            context = "\n\n".join([doc.page_content for doc in docs])
-
-            prompt = (
-                "You are a document summarization assistant working with a certificate or official document.\n"
-                "RULES:\n"
-                "1. Summarize in 6-8 concise bullet points.\n"
-                "2. Clearly distinguish: who received the certificate, what course, which company issued it,\n"
-                "   who signed it, on what platform, and on what date.\n"
-                "3. Return clean, properly formatted text — no character spacing, proper Title Case for names.\n"
-                "4. Use ONLY the information in the context below.\n"
-                "5. DO NOT reference any other documents or previous PDFs.\n\n"
-                f"Context:\n{context}\n\n"
-                "Summary (bullet points):"
-            )
+        cache_key = answer_cache_key("summarize", session_id, upload_time)
+        cached = get_cached_answer(cache_key)
+        if cached is not None:
+            return {"summary": cached}
+
+        docs = await search_batcher.search(vectorstore, SUMMARY_QUERY_VECTOR, 6)
+        if not docs:
+            return {"summary": "No document context available to summarize."}
+
+        context = "\n\n".join([doc.page_content for doc in docs])
 
-            raw_summary = generate_response(prompt, max_new_tokens=512)
-            summary = normalize_answer(raw_summary)
-            return {"summary": summary}
+        prompt = SUMMARIZE_PROMPT.substitute(context=context)
+
+        raw_summary = await generate_response(prompt, max_new_tokens=512)
+        summary = normalize_answer(raw_summary)
+        set_cached_answer(cache_key, summary)
+        return {"summary": summary}
             
     except Exception as e:
         return {"summary": f"Error summarizing PDF: {str(e)}"}
@@ -345,7 +1347,7 @@ def summarize_pdf(request: Request, data: SummarizeRequest):
 
 @app.post("/compare")
 @limiter.limit("15/15 minutes")
-def compare_pdfs(request: Request, data: dict):
+async def compare_pdfs(request: Request, data: dict):
     """
     Compare two PDFs using their session-specific contexts.
     Supports multi-user/multi-PDF comparison feature.
@@ -354,36 +1356,38 @@ def compare_pdfs(request: Request, data: dict):
     session_id_2 = data.get("session_id_2", "default")
     question = data.get("question", "Compare these documents")
     
-    vectorstore_1, _ = get_session_vectorstore(session_id_1)
-    vectorstore_2, _ = get_session_vectorstore(session_id_2)
+    (vectorstore_1, upload_time_1), (vectorstore_2, upload_time_2) = await asyncio.gather(
+        asyncio.to_thread(get_session_vectorstore, session_id_1),
+        asyncio.to_thread(get_session_vectorstore, session_id_2),
+    )
     
     if vectorstore_1 is None or vectorstore_2 is None:
         return {"error": "One or both sessions do not have a PDF loaded"}
     
     try:
-        with sessions_lock:
-            docs_1 = vectorstore_1.similarity_search(question, k=3)
-            docs_2 = vectorstore_2.similarity_search(question, k=3)
-            
-            context_1 = "\n\n".join([doc.page_content for doc in docs_1])
-            context_2 = "\n\n".join([doc.page_content for doc in docs_2])
-            
-            prompt = f"""You are a document comparison assistant.
-
-PDF 1 Context:
-{context_1}
-
-PDF 2 Context:
-{context_2}
-
-Question: {question}
-
-Compare the two documents regarding this question and highlight key differences and similarities.
-
-Comparison:"""
-            
-            comparison = generate_response(prompt, max_new_tokens=512)
-            return {"comparison": normalize_answer(comparison)}
+        cache_key = answer_cache_key(
+            "compare", session_id_1, upload_time_1, session_id_2, upload_time_2, text=question
+        )
+        cached = get_cached_answer(cache_key)
+        if cached is not None:
+            return {"comparison": cached}
+
+        # Same question against both stores: one embedding, one batch
+        docs_1, docs_2 = await asyncio.gather(
+            search_batcher.search(vectorstore_1, question, 3),
+            search_batcher.search(vectorstore_2, question, 3),
+        )
+        
+        context_1 = "\n\n".join([doc.page_content for doc in docs_1])
+        context_2 = "\n\n".join([doc.page_content for doc in docs_2])
+        
+        prompt = COMPARE_PROMPT.substitute(
+            context_1=context_1, context_2=context_2, question=question
+        )
+        
+        comparison = normalize_answer(await generate_response(prompt, max_new_tokens=512))
+        set_cached_answer(cache_key, comparison)
+        return {"comparison": comparison}
             
     except Exception as e:
         return {"error": f"Error comparing PDFs: {str(e)}"}
@@ -397,8 +1401,7 @@ def reset_session(request: Request):
     """
     session_id = request.headers.get("X-Session-ID", "default")
     
-    with sessions_lock:
-        clear_session(session_id)
+    clear_session(session_id)
         
     return {
         "message": "Session cleared successfully",
@@ -414,18 +1417,13 @@ def get_pdf_status(request: Request):
     """
     session_id = request.headers.get("X-Session-ID", "default")
     
-    with sessions_lock:
-        if session_id in sessions:
-            return {
-                "pdf_loaded": True,
-                "session_id": session_id,
-                "upload_time": sessions[session_id].get("upload_time")
-            }
-        return {
-            "pdf_loaded": False,
-            "session_id": session_id,
-            "upload_time": None
-        }
+    # Reads the shared session dir, so any worker reports the same state
+    upload_time = get_session_upload_time(session_id)
+    return {
+        "pdf_loaded": upload_time is not None,
+        "session_id": session_id,
+        "upload_time": upload_time
+    }
 
 
 # -------------------------------------------------------------------
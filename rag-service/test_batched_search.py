@@ -0,0 +1,117 @@
+"""
+Unit tests for the BatchedSearcher in main.py, against stub indexes.
+Run with:  pytest rag-service/test_batched_search.py -v
+"""
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("GROQ_API_KEY", "test")  # AsyncGroq refuses an empty key
+
+import main  # noqa: E402  (importing main loads no model and touches no files)
+
+# ---------------------------------------------------------------------------
+# Stubs
+# ---------------------------------------------------------------------------
+
+class StubEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed_queries(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(t)), 0.0] for t in texts]
+
+
+class StubIndex:
+    """Returns the given row of ids (padded with -1) for every query."""
+
+    def __init__(self, ids, fail=False):
+        self.ids = ids
+        self.fail = fail
+        self.calls = []
+
+    def search(self, queries, k):
+        self.calls.append((queries.copy(), k))
+        if self.fail:
+            raise RuntimeError("index exploded")
+        row = (self.ids + [-1] * k)[:k]
+        indices = np.array([row] * len(queries), dtype=np.int64)
+        return np.zeros(indices.shape, dtype=np.float32), indices
+
+
+class StubDocstore:
+    def search(self, doc_id):
+        return doc_id
+
+
+class StubVectorStore:
+    def __init__(self, name, ids, fail=False):
+        self.index = StubIndex(ids, fail)
+        self.docstore = StubDocstore()
+        self.index_to_docstore_id = {i: f"{name}-{i}" for i in ids}
+
+
+def run_batch(*requests):
+    """Submits every (vectorstore, query, k) at once so they share one window."""
+    async def go():
+        searcher = main.BatchedSearcher(window=0.05)
+        return await asyncio.gather(
+            *(searcher.search(vs, q, k) for vs, q, k in requests),
+            return_exceptions=True,
+        )
+    return asyncio.run(go())
+
+
+@pytest.fixture(autouse=True)
+def embedding_model(monkeypatch):
+    stub = StubEmbeddings()
+    monkeypatch.setattr(main, "embedding_model", stub)
+    return stub
+
+
+# ---------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------
+
+class TestBatchedSearcher:
+    def test_groups_queries_by_vectorstore(self):
+        a = StubVectorStore("a", [0, 1, 2])
+        b = StubVectorStore("b", [5])
+        results = run_batch((a, "q1", 1), (b, "q2", 1), (a, "q3", 1))
+
+        assert results == [["a-0"], ["b-5"], ["a-0"]]
+        assert len(a.index.calls) == 1 and len(a.index.calls[0][0]) == 2
+        assert len(b.index.calls) == 1 and len(b.index.calls[0][0]) == 1
+
+    def test_embeds_distinct_texts_once(self, embedding_model):
+        a = StubVectorStore("a", [0])
+        b = StubVectorStore("b", [0])
+        run_batch((a, "same", 1), (b, "same", 1), (a, "other", 1))
+        assert embedding_model.calls == [["same", "other"]]
+
+    def test_precomputed_vector_skips_embedding(self, embedding_model):
+        a = StubVectorStore("a", [0])
+        assert run_batch((a, [1.0, 2.0], 1)) == [["a-0"]]
+        assert embedding_model.calls == []
+        np.testing.assert_array_equal(a.index.calls[0][0], [[1.0, 2.0]])
+
+    def test_searches_max_k_and_slices_per_caller(self):
+        a = StubVectorStore("a", [0, 1, 2, 3])
+        results = run_batch((a, "q1", 2), (a, "q2", 4))
+        assert a.index.calls[0][1] == 4
+        assert results == [["a-0", "a-1"], ["a-0", "a-1", "a-2", "a-3"]]
+
+    def test_drops_missing_results(self):
+        a = StubVectorStore("a", [0, 1])
+        assert run_batch((a, "q", 4)) == [["a-0", "a-1"]]
+
+    def test_failure_is_isolated_to_its_group(self):
+        good = StubVectorStore("good", [0])
+        bad = StubVectorStore("bad", [0], fail=True)
+        results = run_batch((good, "q", 1), (bad, "q", 1), (bad, "r", 1))
+
+        assert results[0] == ["good-0"]
+        assert all(isinstance(r, RuntimeError) for r in results[1:])
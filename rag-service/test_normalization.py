@@ -0,0 +1,105 @@
+"""
+Unit tests for the spaced-letter normalization in main.py.
+Run with:  pytest rag-service/test_normalization.py -v
+"""
+import random
+import re
+
+import numba
+import numpy as np
+import pytest
+
+# ---------------------------------------------------------------------------
+# Copied helpers (so tests don't need to import the full FastAPI app)
+# ---------------------------------------------------------------------------
+
+_SPACED_RE = re.compile(r"\b(?:[A-Za-z] ){2,}[A-Za-z]\b")
+
+
+def _join_spaced_letters(match):
+    return match.group(0).replace(" ", "")
+
+
+@numba.njit(cache=True)
+def _is_ascii_alpha(c):
+    return (65 <= c <= 90) or (97 <= c <= 122)
+
+
+@numba.njit(cache=True)
+def _is_ascii_word(c):
+    return _is_ascii_alpha(c) or (48 <= c <= 57) or c == 95
+
+
+@numba.njit(cache=True)
+def _collapse_spaced_letters(buf, out):
+    """
+    Single pass over ASCII bytes equivalent to _SPACED_RE.sub: runs of 3+
+    single letters separated by single spaces, bounded by non-word chars,
+    are copied without their spaces. Returns the output length.
+    """
+    n = buf.shape[0]
+    i = 0
+    j = 0
+    while i < n:
+        c = buf[i]
+        if _is_ascii_alpha(c) and (i == 0 or not _is_ascii_word(buf[i - 1])):
+            end = i
+            count = 1
+            while end + 2 < n and buf[end + 1] == 32 and _is_ascii_alpha(buf[end + 2]):
+                end += 2
+                count += 1
+            # Last letter needs a word boundary after it; otherwise back off one
+            if end + 1 < n and _is_ascii_word(buf[end + 1]):
+                end -= 2
+                count -= 1
+            if count >= 3:
+                k = i
+                while k <= end:
+                    out[j] = buf[k]
+                    j += 1
+                    k += 2
+                i = end + 1
+                continue
+        out[j] = c
+        j += 1
+        i += 1
+    return j
+
+
+def collapse(text: str) -> str:
+    buf = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    out = np.empty(len(buf), dtype=np.uint8)
+    n = _collapse_spaced_letters(buf, out)
+    return out[:n].tobytes().decode("ascii")
+
+
+def regex_collapse(text: str) -> str:
+    return _SPACED_RE.sub(_join_spaced_letters, text)
+
+
+# ---------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------
+
+class TestCollapseSpacedLetters:
+    @pytest.mark.parametrize("text, expected", [
+        ("C e r t i f i c a t e", "Certificate"),
+        ("Awarded to J o h n D o e", "Awarded to JohnDoe"),
+        ("a b", "a b"),
+        ("a b cd", "a b cd"),
+        ("a b c de", "abc de"),
+        ("xa b c", "xa b c"),
+        ("(a b c)", "(abc)"),
+        ("a  b  c", "a  b  c"),
+        ("", ""),
+    ])
+    def test_examples(self, text, expected):
+        assert collapse(text) == expected
+        assert regex_collapse(text) == expected
+
+    def test_matches_regex_on_random_text(self):
+        rng = random.Random(0)
+        alphabet = "ab Z1_ .\n"
+        for _ in range(2000):
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+            assert collapse(text) == regex_collapse(text), repr(text)
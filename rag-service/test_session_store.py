@@ -0,0 +1,230 @@
+"""
+Unit tests for the shared session store in main.py (files + per-process cache).
+Run with:  pytest rag-service/test_session_store.py -v
+"""
+import json
+import os
+import stat
+import threading
+import time
+import uuid
+
+import faiss
+import numpy as np
+import pytest
+
+os.environ.setdefault("GROQ_API_KEY", "test")  # AsyncGroq refuses an empty key
+
+import main  # noqa: E402  (importing main loads no model and touches no files)
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+@pytest.fixture(autouse=True)
+def session_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "SESSION_DIR", tmp_path)
+    main.sessions.clear()
+    yield tmp_path
+    main.sessions.clear()
+
+
+def committed_index(session_id):
+    token = main._read_session_meta(main._session_meta_path(session_id))["token"]
+    return main.SESSION_DIR / f"{main._session_key(session_id)}.{token}.faiss"
+
+
+def age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def upload(session_id, tag):
+    """Commits a one-chunk session whose text and upload_time are both tag."""
+    index = faiss.IndexFlatIP(4)
+    index.add(np.ones((1, 4), dtype=np.float32))
+    main.set_session_index(session_id, faiss.serialize_index(index), [tag], [{}], tag)
+
+
+def cached_text(session_id):
+    vectorstore, _ = main.get_session_vectorstore(session_id)
+    doc_id = vectorstore.index_to_docstore_id[0]
+    return vectorstore.docstore.search(doc_id).page_content
+
+
+# ---------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------
+
+class TestSetSessionIndex:
+    def test_replaces_previous_index(self, session_dir):
+        upload("s", "first")
+        upload("s", "second")
+        assert main.get_session_upload_time("s") == "second"
+        assert list(session_dir.glob("*.faiss")) == [committed_index("s")]
+        assert len(list(session_dir.glob("*.chunks.json"))) == 1
+
+    def test_concurrent_upload_cannot_delete_committed_index(self, monkeypatch):
+        # Pause upload A between writing its index and committing <key>.json,
+        # then start upload B for the same session.
+        a_paused, a_resume = threading.Event(), threading.Event()
+        real_replace = os.replace
+
+        def replace(src, dst):
+            if threading.current_thread().name == "A":
+                a_paused.set()
+                a_resume.wait(5)
+            real_replace(src, dst)
+
+        monkeypatch.setattr(os, "replace", replace)
+        a = threading.Thread(target=upload, args=("s", "A"), name="A")
+        b = threading.Thread(target=upload, args=("s", "B"), name="B")
+        a.start()
+        assert a_paused.wait(5)
+        b.start()
+        b.join(0.2)
+        a_resume.set()
+        a.join(5)
+        b.join(5)
+
+        index = committed_index("s")
+        assert index.exists()
+        assert list(main.SESSION_DIR.glob("*.faiss")) == [index]
+        assert cached_text("s") in ("A", "B")
+
+    def test_clear_removes_all_files(self, session_dir):
+        upload("s", "x")
+        upload("other", "y")
+        main.clear_session("s")
+        assert not main._session_meta_path("s").exists()
+        assert main.get_session_upload_time("s") is None
+        assert main.get_session_upload_time("other") == "y"
+        assert list(session_dir.glob("*.faiss")) == [committed_index("other")]
+
+
+class TestGetSessionVectorstore:
+    def test_missing_session(self):
+        assert main.get_session_vectorstore("nobody") == (None, None)
+
+    def test_caches_loaded_store(self):
+        upload("s", "x")
+        first, upload_time = main.get_session_vectorstore("s")
+        assert upload_time == "x"
+        assert main.get_session_vectorstore("s")[0] is first
+
+    def test_reloads_after_replacement_by_another_worker(self, monkeypatch):
+        upload("s", "old")
+        assert cached_text("s") == "old"
+        # Another worker's upload: files change, this process's cache isn't told
+        monkeypatch.setattr(main, "_drop_cached_session", lambda session_id: None)
+        upload("s", "new")
+        assert cached_text("s") == "new"
+
+    def test_drops_cache_when_cleared_elsewhere(self):
+        upload("s", "x")
+        main.get_session_vectorstore("s")
+        main._session_meta_path("s").unlink()
+        assert main.get_session_vectorstore("s") == (None, None)
+        assert "s" not in main.sessions
+
+
+class TestSessionDir:
+    def test_creates_private_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, "SESSION_DIR", tmp_path / "sessions")
+        main.prepare_session_dir()
+        assert stat.S_IMODE(main.SESSION_DIR.stat().st_mode) & 0o077 == 0
+
+    def test_rejects_writable_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, "SESSION_DIR", tmp_path / "sessions")
+        main.SESSION_DIR.mkdir()
+        main.SESSION_DIR.chmod(0o777)
+        with pytest.raises(RuntimeError):
+            main.prepare_session_dir()
+
+    def test_rejects_symlink(self, tmp_path, monkeypatch):
+        (tmp_path / "elsewhere").mkdir(mode=0o700)
+        monkeypatch.setattr(main, "SESSION_DIR", tmp_path / "sessions")
+        main.SESSION_DIR.symlink_to(tmp_path / "elsewhere")
+        with pytest.raises(RuntimeError):
+            main.prepare_session_dir()
+
+    def test_rejects_meta_pointing_outside_session(self):
+        main._session_meta_path("s").write_text(
+            json.dumps({"upload_time": "t", "token": "../../etc"})
+        )
+        with pytest.raises(ValueError):
+            main.get_session_upload_time("s")
+
+
+class TestSweepExpiredSessions:
+    def test_removes_expired_and_keeps_live(self, session_dir):
+        upload("old", "x")
+        upload("new", "y")
+        for path in session_dir.glob(f"{main._session_key('old')}.*"):
+            age(path, main.SESSION_TTL_SECONDS + 1)
+
+        main.sweep_expired_sessions()
+
+        assert main.get_session_upload_time("old") is None
+        assert not list(session_dir.glob(f"{main._session_key('old')}.*"))
+        assert main.get_session_upload_time("new") == "y"
+        assert cached_text("new") == "y"
+
+    def test_removes_orphaned_data_files(self, session_dir):
+        upload("s", "x")
+        orphan = session_dir / f"{main._session_key('s')}.{uuid.uuid4().hex}.faiss"
+        orphan.write_bytes(b"left by a crashed writer")
+        main.sweep_expired_sessions()
+        assert not orphan.exists()
+        assert committed_index("s").exists()
+
+
+class TestPruneSessionCache:
+    def test_drops_swept_session(self, session_dir):
+        upload("s", "x")
+        main.get_session_vectorstore("s")
+        for path in session_dir.glob(f"{main._session_key('s')}.*"):
+            age(path, main.SESSION_TTL_SECONDS + 1)
+        main.sweep_expired_sessions()
+
+        main.prune_session_cache()
+        assert "s" not in main.sessions
+
+    def test_drops_session_replaced_by_another_worker(self, monkeypatch):
+        upload("s", "old")
+        main.get_session_vectorstore("s")
+        monkeypatch.setattr(main, "_drop_cached_session", lambda session_id: None)
+        upload("s", "new")
+
+        main.prune_session_cache()
+        assert "s" not in main.sessions
+
+    def test_keeps_current_session(self):
+        upload("s", "x")
+        vectorstore, _ = main.get_session_vectorstore("s")
+        main.prune_session_cache()
+        assert main.sessions["s"]["vectorstore"] is vectorstore
+
+    def test_cache_is_bounded(self):
+        for i in range(main.SESSION_CACHE_SIZE + 5):
+            upload(f"s{i}", "x")
+            main.get_session_vectorstore(f"s{i}")
+        assert len(main.sessions) == main.SESSION_CACHE_SIZE
+        assert f"s{main.SESSION_CACHE_SIZE + 4}" in main.sessions
+
+
+class TestGpuSlots:
+    def test_slots_are_bounded_and_survive_sweep(self, session_dir, monkeypatch):
+        monkeypatch.setattr(main, "FAISS_GPU_PROCESSES", 1)
+        monkeypatch.setattr(main, "_gpu_slot", None)
+        assert main._claim_gpu_slot()
+        held = main._gpu_slot
+        try:
+            assert not main._claim_gpu_slot()
+            main.sweep_expired_sessions()
+            assert (session_dir / ".gpu-slot-0").exists()
+        finally:
+            held.close()
+        assert main._claim_gpu_slot()
+        main._gpu_slot.close()